@@ -0,0 +1,333 @@
+"""Load generator for the TodoTracker API.
+
+Seeds a synthetic database in a throwaway HOME, then replays a weighted
+workload mix against the app from many asyncio clients at a target rate.
+
+    python -m TodoTracker.server.loadtest --rate 200 --duration 30
+    python -m TodoTracker.server.loadtest --mode uvicorn --families 8 --json out.json
+
+Latency is measured from each request's scheduled send time, so a server
+that falls behind shows up in the percentiles instead of silently lowering
+the offered load.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+DEFAULT_MIX = "list=40,search=10,create=15,complete=15,undo=5,streak=10,summary=5"
+
+SEARCH_WORDS = ("报告", "设计", "review", "买菜", "健身", "会议", "阅读", "修复")
+CATEGORIES = ("产品", "设计", "开发", "学习", "生活", "临时")
+PRIORITIES = ("低", "中", "高")
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix: Dict[str, int] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown operation: {name!r} (expected one of {', '.join(OPERATIONS)})")
+        mix[name] = int(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("workload mix is empty")
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile over an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class RouteStats:
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    locks: int = 0
+
+    def summary(self, elapsed: float) -> dict:
+        lat = sorted(self.latencies_ms)
+        return {
+            "requests": len(lat),
+            "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(lat, 50), 2),
+            "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2),
+            "max_ms": round(lat[-1], 2) if lat else 0.0,
+            "errors": self.errors,
+            "locks": self.locks,
+        }
+
+
+class Workload:
+    """Per-family task ids the operations draw from."""
+
+    def __init__(self, families: List[Optional[str]], task_ids: Dict[Optional[str], List[int]], rng: random.Random):
+        self.families = families
+        self.task_ids = task_ids
+        self.rng = rng
+
+    def headers(self, family: Optional[str]) -> Dict[str, str]:
+        return {"X-Family-Id": family} if family else {}
+
+    def pick_task(self, family: Optional[str]) -> int:
+        ids = self.task_ids[family]
+        return self.rng.choice(ids) if ids else 1
+
+
+# Each operation returns (route label, method, url, json body)
+def _op_list(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    url = "/tasks"
+    if w.rng.random() < 0.5:
+        url += f"?category={w.rng.choice(CATEGORIES)}"
+    return "GET /tasks", "GET", url, None
+
+
+def _op_search(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    return "GET /tasks?search", "GET", f"/tasks?search={w.rng.choice(SEARCH_WORDS)}", None
+
+
+def _op_create(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    body = {
+        "title": f"{w.rng.choice(SEARCH_WORDS)} #{w.rng.randint(1, 10**6)}",
+        "category": w.rng.choice(CATEGORIES),
+        "priority": w.rng.choice(PRIORITIES),
+    }
+    return "POST /tasks", "POST", "/tasks", body
+
+
+def _op_complete(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    return "POST /tasks/{id}/complete", "POST", f"/tasks/{w.pick_task(family)}/complete", {"evidence": "loadtest"}
+
+
+def _op_undo(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    return "POST /tasks/{id}/uncomplete", "POST", f"/tasks/{w.pick_task(family)}/uncomplete", None
+
+
+def _op_streak(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    return "GET /streak", "GET", "/streak", None
+
+
+def _op_summary(w: Workload, family: Optional[str]) -> Tuple[str, str, str, Optional[dict]]:
+    return "GET /summary/today", "GET", "/summary/today", None
+
+
+OPERATIONS = {
+    "list": _op_list,
+    "search": _op_search,
+    "create": _op_create,
+    "complete": _op_complete,
+    "undo": _op_undo,
+    "streak": _op_streak,
+    "summary": _op_summary,
+}
+
+
+def seed(families: List[Optional[str]], tasks_per_family: int, rng: random.Random) -> Dict[Optional[str], List[int]]:
+    """Fill each (family) database with synthetic tasks; HOME must already point at the scratch dir."""
+    from TodoTracker.todo_tracker.shards import family_session
+    from TodoTracker.todo_tracker.storage import add_task, record_completion
+
+    task_ids: Dict[Optional[str], List[int]] = {}
+    for family in families:
+        ids: List[int] = []
+        with ExitStack() as stack:
+            if family:
+                stack.enter_context(family_session(family))
+            for i in range(tasks_per_family):
+                tid = add_task(
+                    title=f"{rng.choice(SEARCH_WORDS)} {i}",
+                    description=rng.choice(SEARCH_WORDS),
+                    category=rng.choice(CATEGORIES),
+                    priority=rng.choice(PRIORITIES),
+                    recurrence="daily" if i % 20 == 0 else None,
+                )
+                ids.append(tid)
+                if rng.random() < 0.3:
+                    record_completion(tid)
+        task_ids[family] = ids
+    return task_ids
+
+
+async def run_load(client: httpx.AsyncClient, workload: Workload, mix: Dict[str, int], *, rate: float, duration: float, concurrency: int) -> Tuple[Dict[str, RouteStats], float]:
+    stats: Dict[str, RouteStats] = {}
+    queue: "asyncio.Queue[Optional[Tuple[float, str]]]" = asyncio.Queue()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+
+    async def producer() -> None:
+        # Open-loop schedule: one request every 1/rate seconds regardless of responses
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        total = int(rate * duration)
+        for i in range(total):
+            scheduled = start + i / rate
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            queue.put_nowait((scheduled, workload.rng.choices(names, weights)[0]))
+        for _ in range(concurrency):
+            queue.put_nowait(None)
+
+    async def worker() -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            scheduled, name = item
+            family = workload.rng.choice(workload.families)
+            route, method, url, body = OPERATIONS[name](workload, family)
+            st = stats.setdefault(route, RouteStats())
+            try:
+                resp = await client.request(method, url, json=body, headers=workload.headers(family))
+                if resp.status_code >= 400:
+                    st.errors += 1
+                    if resp.status_code == 503 and "locked" in resp.text:
+                        st.locks += 1
+                elif name == "create":
+                    workload.task_ids[family].append(int(resp.json()["id"]))
+            except httpx.HTTPError:
+                st.errors += 1
+            st.latencies_ms.append((loop.time() - scheduled) * 1000)
+
+    began = time.perf_counter()
+    await asyncio.gather(producer(), *(worker() for _ in range(concurrency)))
+    return stats, time.perf_counter() - began
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_healthy(base_url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not become healthy")
+
+
+def build_report(stats: Dict[str, RouteStats], elapsed: float, config: dict) -> dict:
+    total = RouteStats()
+    for st in stats.values():
+        total.latencies_ms.extend(st.latencies_ms)
+        total.errors += st.errors
+        total.locks += st.locks
+    return {
+        "config": config,
+        "elapsed_s": round(elapsed, 3),
+        "total": total.summary(elapsed),
+        "routes": {route: st.summary(elapsed) for route, st in sorted(stats.items())},
+    }
+
+
+def format_table(report: dict) -> str:
+    header = f"{'route':<30}{'reqs':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'lock':>6}"
+    lines = [header, "-" * len(header)]
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for route, r in rows:
+        lines.append(
+            f"{route:<30}{r['requests']:>8}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['errors']:>6}{r['locks']:>6}"
+        )
+    return "\n".join(lines)
+
+
+async def _main_async(args: argparse.Namespace, mix: Dict[str, int], home: Path) -> dict:
+    rng = random.Random(args.seed)
+    families: List[Optional[str]] = [f"load{i}" for i in range(args.families)] if args.families else [None]
+    task_ids = seed(families, args.seed_tasks, rng)
+    workload = Workload(families, task_ids, rng)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    config = {k: v for k, v in vars(args).items() if k != "json"}
+    config["mix"] = mix
+
+    if args.mode == "inprocess":
+        from TodoTracker.server.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            stats, elapsed = await run_load(client, workload, mix, rate=args.rate, duration=args.duration, concurrency=args.concurrency)
+        return build_report(stats, elapsed, config)
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, HOME=str(home))
+    cmd = [sys.executable, "-m", "uvicorn", "TodoTracker.server.main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=str(REPO_ROOT), env=env)
+    try:
+        await _wait_healthy(base_url)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            stats, elapsed = await run_load(client, workload, mix, rate=args.rate, duration=args.duration, concurrency=args.concurrency)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return build_report(stats, elapsed, config)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m TodoTracker.server.loadtest", description="TodoTracker API load generator")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess", help="drive the ASGI app directly or through uvicorn on localhost")
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=32, help="number of asyncio clients")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--families", type=int, default=0, help="spread load over N family shards (0 = default database)")
+    parser.add_argument("--seed-tasks", type=int, default=500, help="synthetic tasks per database")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (uvicorn mode)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", help="write the JSON report to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with tempfile.TemporaryDirectory(prefix="todotracker-load-") as tmp:
+        # Everything (default db, shards, summaries) lands under the scratch HOME
+        os.environ["HOME"] = tmp
+        report = asyncio.run(_main_async(args, mix, Path(tmp)))
+
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_table(report))
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,25 +1,36 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import asyncio
+import datetime as dt
+import sqlite3
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
 from dataclasses import asdict
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 
 from TodoTracker.todo_tracker.storage import (
     Task,
     add_task,
     delete_task,
-    export_daily_summary,
     last_7_day_streak,
+    list_occurrences,
     list_tasks,
     quick_complete,
+    task_facets,
     record_completion,
     undo_last_completion,
     update_task,
 )
-from TodoTracker.todo_tracker.config import category_presets
+from TodoTracker.todo_tracker.config import MAX_OCCURRENCE_WINDOW_DAYS, category_presets, family_concurrency, family_queue_seconds, shard_idle_seconds
+from TodoTracker.todo_tracker.db import shard_pool
+from TodoTracker.todo_tracker.jobs import JobManager, JobQueueFull
+from TodoTracker.todo_tracker.shards import family_session, valid_family_id
 
 
 class TaskCreate(BaseModel):
@@ -28,6 +39,7 @@ class TaskCreate(BaseModel):
     category: Optional[str] = ""
     priority: Optional[str] = "中"
     due_date: Optional[str] = None
+    recurrence: Optional[str] = None
 
 
 class TaskUpdate(BaseModel):
@@ -36,13 +48,80 @@ class TaskUpdate(BaseModel):
     category: Optional[str] = None
     priority: Optional[str] = None
     due_date: Optional[str] = None
+    recurrence: Optional[str] = None
 
 
-class Evidence(BaseModel):
-    evidence: Optional[str] = None
+class JobCreate(BaseModel):
+    kind: str
+    params: Optional[dict] = None
 
 
-app = FastAPI(title="TodoTracker API")
+class Evidence(BaseModel):
+    evidence: Optional[str] = None
+    occurrence_date: Optional[str] = None
+
+
+# family -> [admission semaphore, requests holding or waiting on it]
+_family_slots: Dict[str, list] = {}
+
+
+async def family_scope(x_family_id: Optional[str] = Header(None)):
+    """Route storage calls of this request to the caller's family shard.
+
+    The family comes from the X-Family-Id header only; the Authorization header
+    is left to real authentication. Requests without it use the shared default
+    database.
+    """
+    family = x_family_id
+    if not family:
+        yield
+        return
+    if not valid_family_id(family):
+        raise HTTPException(status_code=400, detail="invalid family id")
+    # Admit at most family_concurrency() requests per family into the threadpool;
+    # the rest wait here on the event loop, so one busy family cannot starve the others.
+    slot = _family_slots.get(family)
+    if slot is None:
+        slot = _family_slots[family] = [asyncio.Semaphore(family_concurrency()), 0]
+    slot[1] += 1
+    try:
+        try:
+            await asyncio.wait_for(slot[0].acquire(), timeout=family_queue_seconds())
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="family is busy", headers={"Retry-After": "1"})
+        try:
+            with family_session(family):
+                yield
+        finally:
+            slot[0].release()
+    finally:
+        slot[1] -= 1
+        if slot[1] == 0:
+            del _family_slots[family]
+
+
+# CPU-heavy exports/aggregations run here instead of in request threads
+jobs = JobManager()
+
+
+async def _sweep_shards() -> None:
+    # Close idle shards even when no new request arrives to trigger eviction
+    interval = max(1.0, min(60.0, shard_idle_seconds() / 2))
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(shard_pool().evict_idle)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(_sweep_shards())
+    yield
+    sweeper.cancel()
+    jobs.shutdown()
+    shard_pool().close_all()
+
+
+app = FastAPI(title="TodoTracker API", dependencies=[Depends(family_scope)], lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -57,6 +136,15 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(sqlite3.OperationalError)
+async def sqlite_busy(request: Request, exc: sqlite3.OperationalError):
+    # Lock/busy contention is retryable; report it as such instead of a bare 500
+    msg = str(exc)
+    if "locked" in msg or "busy" in msg:
+        return JSONResponse(status_code=503, content={"detail": "database is locked"}, headers={"Retry-After": "1"})
+    raise exc
+
+
 @app.get("/health")
 def health() -> dict:
     return {"status": "ok"}
@@ -67,34 +155,50 @@ def categories() -> list[str]:
     return category_presets()
 
 
+@app.get("/tasks/facets")
+def get_task_facets() -> dict:
+    return task_facets()
+
+
 @app.get("/tasks")
-def get_tasks(search: Optional[str] = None, category: Optional[str] = None) -> List[dict]:
+def get_tasks(search: Optional[str] = None, category: Optional[str] = None, facets: bool = False):
     # Convert dataclass Task -> dict to avoid Pydantic schema issues
-    return [asdict(t) for t in list_tasks(search=search, category=category)]
+    tasks = [asdict(t) for t in list_tasks(search=search, category=category)]
+    if facets:
+        return {"tasks": tasks, "facets": task_facets()}
+    return tasks
 
 
 @app.post("/tasks")
 def create_task(data: TaskCreate) -> dict:
-    tid = add_task(
-        title=data.title,
-        description=data.description or "",
-        category=data.category or "",
-        priority=data.priority or "中",
-        due_date=data.due_date,
-    )
+    try:
+        tid = add_task(
+            title=data.title,
+            description=data.description or "",
+            category=data.category or "",
+            priority=data.priority or "中",
+            due_date=data.due_date,
+            recurrence=data.recurrence,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"id": tid}
 
 
 @app.patch("/tasks/{task_id}")
 def patch_task(task_id: int, data: TaskUpdate) -> dict:
-    update_task(
-        task_id,
-        title=data.title,
-        description=data.description,
-        category=data.category,
-        priority=data.priority,
-        due_date=data.due_date,
-    )
+    try:
+        update_task(
+            task_id,
+            title=data.title,
+            description=data.description,
+            category=data.category,
+            priority=data.priority,
+            due_date=data.due_date,
+            recurrence=data.recurrence,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"ok": True}
 
 
@@ -106,16 +210,31 @@ def remove_task(task_id: int) -> dict:
 
 @app.post("/tasks/{task_id}/complete")
 def complete_task(task_id: int, body: Evidence) -> dict:
-    cid = record_completion(task_id, evidence=body.evidence)
+    try:
+        cid = record_completion(task_id, evidence=body.evidence, occurrence_date=body.occurrence_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"completion_id": cid}
 
 
 @app.post("/tasks/{task_id}/uncomplete")
-def uncomplete_task(task_id: int) -> dict:
-    deleted_id = undo_last_completion(task_id)
+def uncomplete_task(task_id: int, occurrence_date: Optional[str] = None) -> dict:
+    deleted_id = undo_last_completion(task_id, occurrence_date=occurrence_date)
     return {"removed_completion_id": deleted_id}
 
 
+@app.get("/occurrences")
+def get_occurrences(start: Optional[str] = None, end: Optional[str] = None, category: Optional[str] = None) -> List[dict]:
+    try:
+        start_day = dt.date.fromisoformat(start) if start else dt.date.today()
+        end_day = dt.date.fromisoformat(end) if end else start_day + dt.timedelta(days=6)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if end_day < start_day or (end_day - start_day).days >= MAX_OCCURRENCE_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail="invalid occurrence window")
+    return [asdict(o) for o in list_occurrences(start_day, end_day, category=category)]
+
+
 @app.post("/quick-complete")
 def quick(data: TaskCreate) -> dict:
     tid, cid = quick_complete(data.title, evidence=None)
@@ -127,7 +246,72 @@ def streak() -> List[bool]:
     return last_7_day_streak()
 
 
-@app.get("/summary/today")
-def summary_today() -> dict:
-    txt, csv = export_daily_summary()
-    return {"txt": str(txt), "csv": str(csv)}
\ No newline at end of file
+# How long GET /summary/today waits for its job before answering 202
+SUMMARY_WAIT_SECONDS = 10.0
+
+
+@app.get("/summary/today", deprecated=True)
+async def summary_today():
+    """Run today's summary as a daily_summary job and wait for it on the event loop.
+
+    Kept for existing clients; new ones should POST /jobs and poll. Returns the
+    job's file paths when it finishes in time, otherwise 202 with the job status.
+    """
+    try:
+        job = await run_in_threadpool(jobs.submit, "daily_summary")
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SUMMARY_WAIT_SECONDS
+    info = jobs.describe(job)
+    while info["status"] in ("queued", "running"):
+        if loop.time() >= deadline:
+            return JSONResponse(status_code=202, content=info)
+        await asyncio.sleep(0.05)
+        info = jobs.describe(job)
+    if info["status"] != "done":
+        raise HTTPException(status_code=500 if info["status"] == "failed" else 409, detail=info["error"] or f"job is {info['status']}")
+    # Files are fixed once a job is done
+    return {"job_id": job.id, "txt": job.files["txt"], "csv": job.files["csv"]}
+
+
+@app.post("/jobs", status_code=202)
+def create_job(data: JobCreate) -> dict:
+    try:
+        job = jobs.submit(data.kind, data.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return jobs.describe(job)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> dict:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return jobs.describe(job)
+
+
+@app.get("/jobs/{job_id}/files/{name}")
+def get_job_file(job_id: str, name: str) -> FileResponse:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    info = jobs.describe(job)
+    if info["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"job is {info['status']}")
+    # Files are fixed once a job is done
+    path = job.files.get(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="file not found")
+    return FileResponse(path, filename=Path(path).name)
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str) -> dict:
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return jobs.describe(job)
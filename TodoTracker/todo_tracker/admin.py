@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+from typing import List, Optional
+
+from .db import shard_pool
+
+
+def _cmd_list(args: argparse.Namespace) -> int:
+    shards = shard_pool().list_shards()
+    if not shards:
+        print("(no shards)")
+        return 0
+    for info in shards:
+        print(f"{info.family_id}\t{info.size_bytes}\t{info.path}")
+    return 0
+
+
+def _cmd_compact(args: argparse.Namespace) -> int:
+    # One bad shard (missing, invalid id, locked, corrupt) must not stop the rest
+    pool = shard_pool()
+    families = args.family or [info.family_id for info in pool.list_shards()]
+    failed = 0
+    for family_id in families:
+        try:
+            reclaimed = pool.compact(family_id)
+        except FileNotFoundError:
+            print(f"{family_id}\tmissing")
+            failed += 1
+            continue
+        except (ValueError, sqlite3.DatabaseError) as e:
+            print(f"{family_id}\terror: {e}")
+            failed += 1
+            continue
+        print(f"{family_id}\treclaimed {reclaimed} bytes")
+    pool.close_all()
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m todo_tracker.admin", description="TodoTracker 管理命令")
+    sub = parser.add_subparsers(dest="command", required=True)
+    shards = sub.add_parser("shards", help="家庭分片数据库")
+    shards_sub = shards.add_subparsers(dest="action", required=True)
+    p_list = shards_sub.add_parser("list", help="列出分片")
+    p_list.set_defaults(func=_cmd_list)
+    p_compact = shards_sub.add_parser("compact", help="VACUUM 分片（默认全部）")
+    p_compact.add_argument("family", nargs="*", help="家庭 ID")
+    p_compact.set_defaults(func=_cmd_compact)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 from pathlib import Path
 from typing import List
 
@@ -12,6 +13,49 @@ def summaries_dir() -> Path:
     return Path.home() / "Documents" / "TodoTracker" / "summaries"
 
 
+def shards_dir() -> Path:
+    return Path.home() / "Documents" / "TodoTracker" / "shards"
+
+
+def shard_pool_size() -> int:
+    # Max number of family shards kept open at once
+    return int(os.environ.get("TODOTRACKER_SHARD_POOL_SIZE", "32"))
+
+
+def shard_idle_seconds() -> float:
+    # Open shards unused for this long are closed
+    return float(os.environ.get("TODOTRACKER_SHARD_IDLE_SECONDS", "300"))
+
+
+def shard_conns() -> int:
+    # Connections per open shard; readers share them, SQLite serializes the writers
+    return int(os.environ.get("TODOTRACKER_SHARD_CONNS", "4"))
+
+
+def family_concurrency() -> int:
+    # Requests per family allowed into the worker threadpool at once
+    return int(os.environ.get("TODOTRACKER_FAMILY_CONCURRENCY", "4"))
+
+
+def family_queue_seconds() -> float:
+    # How long a request waits for its family's slot before getting 503
+    return float(os.environ.get("TODOTRACKER_FAMILY_QUEUE_SECONDS", "2"))
+
+
+def jobs_dir() -> Path:
+    return Path.home() / "Documents" / "TodoTracker" / "jobs"
+
+
+def job_workers() -> int:
+    # Worker processes for background exports/aggregations
+    return int(os.environ.get("TODOTRACKER_JOB_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+
+def job_max_pending() -> int:
+    # Jobs queued or running at once; further submissions are rejected
+    return int(os.environ.get("TODOTRACKER_JOB_MAX_PENDING", "32"))
+
+
 def ensure_dirs() -> None:
     # Ensure parent directories exist
     dbp = db_path()
@@ -31,4 +75,7 @@ def category_presets() -> List[str]:
     ]
 
 
-PRIORITY_SET = ("低", "中", "高")
\ No newline at end of file
+PRIORITY_SET = ("低", "中", "高")
+
+# Largest date window occurrences are expanded over in one request/job
+MAX_OCCURRENCE_WINDOW_DAYS = 366
\ No newline at end of file
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
 from pathlib import Path
 from typing import Iterable, Optional
 
-from .config import db_path, ensure_dirs
+from .config import db_path, ensure_dirs, shard_conns, shard_idle_seconds, shard_pool_size, shards_dir
+from .shards import ShardPool, current_family
 
 
 SCHEMA_TASKS = """
@@ -17,7 +19,8 @@ CREATE TABLE IF NOT EXISTS tasks (
     created_at TEXT NOT NULL,
     due_date TEXT,
     status TEXT CHECK(status IN ('未完成','已完成')) DEFAULT '未完成',
-    is_temp INTEGER DEFAULT 0
+    is_temp INTEGER DEFAULT 0,
+    recurrence TEXT
 );
 """
 
@@ -27,12 +30,136 @@ CREATE TABLE IF NOT EXISTS completions (
     task_id INTEGER NOT NULL,
     completed_at TEXT NOT NULL,
     evidence TEXT,
+    occurrence_date TEXT,
     FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE
 );
 """
 
+# Columns added after the initial schema; older databases are migrated in place.
+MIGRATION_COLUMNS = (
+    ("tasks", "recurrence", "TEXT"),
+    ("completions", "occurrence_date", "TEXT"),
+)
+
+# At most one completion per occurrence of a recurring task (NULL dates stay unconstrained)
+SCHEMA_INDEXES = "CREATE UNIQUE INDEX IF NOT EXISTS idx_completions_occurrence_unique ON completions(task_id, occurrence_date)"
+
+
+class _ReadOnlyConnection(sqlite3.Connection):
+    # Only opened on databases that were already migrated
+    migrated = True
+
+
+_readonly_path: Optional[Path] = None
+
+
+def use_readonly(path: Optional[Path]) -> None:
+    """让本进程内的 connect() 以只读方式打开 path（用于后台任务进程）。"""
+    global _readonly_path
+    _readonly_path = path
+
+
+# Facet counters over tasks, kept current by triggers in the same transaction as each write.
+# The 'due' facet counts open, non-recurring tasks per due day; overdue = days before today.
+FACETS = (
+    ("category", "COALESCE({r}.category, '')", "1"),
+    ("priority", "COALESCE({r}.priority, '中')", "1"),
+    ("status", "COALESCE({r}.status, '未完成')", "1"),
+    ("due", "substr({r}.due_date, 1, 10)", "COALESCE({r}.status, '未完成') = '未完成' AND {r}.due_date IS NOT NULL AND {r}.recurrence IS NULL"),
+)
+
+_FACET_BUMP = (
+    "INSERT INTO facet_counts(facet, value, count) SELECT '{facet}', {expr}, {delta} WHERE {cond} "
+    "ON CONFLICT(facet, value) DO UPDATE SET count = count + excluded.count;"
+)
+
+
+def _facet_bumps(r: str, delta: int) -> str:
+    return "\n        ".join(
+        _FACET_BUMP.format(facet=facet, expr=expr.format(r=r), cond=cond.format(r=r), delta=delta)
+        for facet, expr, cond in FACETS
+    )
+
+
+SCHEMA_FACETS = (
+    """
+    CREATE TABLE IF NOT EXISTS facet_counts (
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (facet, value)
+    ) WITHOUT ROWID
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_facets_insert AFTER INSERT ON tasks BEGIN
+        {_facet_bumps("NEW", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_facets_delete AFTER DELETE ON tasks BEGIN
+        {_facet_bumps("OLD", -1)}
+        DELETE FROM facet_counts WHERE count <= 0;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_facets_update AFTER UPDATE OF category, priority, status, due_date, recurrence ON tasks BEGIN
+        {_facet_bumps("OLD", -1)}
+        {_facet_bumps("NEW", 1)}
+        DELETE FROM facet_counts WHERE count <= 0;
+    END
+    """,
+)
+
+
+def rebuild_facets(conn: sqlite3.Connection) -> None:
+    """按 tasks 全量重算 facet_counts（用于给旧数据库补建计数）。"""
+    conn.execute("DELETE FROM facet_counts")
+    for facet, expr, cond in FACETS:
+        conn.execute(
+            f"INSERT INTO facet_counts(facet, value, count) SELECT '{facet}', {expr.format(r='t')}, COUNT(*) "
+            f"FROM tasks AS t WHERE {cond.format(r='t')} GROUP BY 2"
+        )
+
+
+_shard_pool: Optional[ShardPool] = None
+_shard_pool_lock = threading.Lock()
+
+
+def _open_shard(path: Path, migrate: bool) -> sqlite3.Connection:
+    # Shard connections are reused across request threads, one lease at a time.
+    # WAL lets readers run alongside the single writer; writers wait briefly on each other.
+    conn = sqlite3.connect(str(path), timeout=1.0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    if migrate:
+        conn.execute("PRAGMA journal_mode = WAL")
+        init_db(conn)
+    return conn
+
+
+def shard_pool() -> ShardPool:
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is None:
+            _shard_pool = ShardPool(
+                shards_dir(),
+                _open_shard,
+                max_open=shard_pool_size(),
+                idle_seconds=shard_idle_seconds(),
+                conns_per_shard=shard_conns(),
+            )
+        return _shard_pool
+
 
 def connect() -> sqlite3.Connection:
+    if _readonly_path is not None:
+        conn = sqlite3.connect(f"{_readonly_path.resolve().as_uri()}?mode=ro", uri=True, factory=_ReadOnlyConnection)
+        conn.row_factory = sqlite3.Row
+        return conn
+    # Inside a family_session() requests go to that family's shard
+    family = current_family()
+    if family is not None:
+        return shard_pool().acquire(family)
     ensure_dirs()
     path: Path = db_path()
     conn = sqlite3.connect(str(path))
@@ -41,15 +168,58 @@ def connect() -> sqlite3.Connection:
     return conn
 
 
+def _migrate_columns(conn: sqlite3.Connection) -> None:
+    for table, column, decl in MIGRATION_COLUMNS:
+        existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Bump when adding a step to _migrate(); stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """在一个写事务内执行一次性迁移并记录版本号；失败时整体回滚，下次 init_db 重试。"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-check under the write lock: another connection may have just migrated
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_columns(conn)
+            for stmt in SCHEMA_FACETS:
+                conn.execute(stmt)
+            rebuild_facets(conn)
+        if version < 2:
+            # Concurrent completes could insert the same occurrence twice; keep the first, then enforce it
+            conn.execute(
+                "DELETE FROM completions WHERE occurrence_date IS NOT NULL AND id NOT IN "
+                "(SELECT MIN(id) FROM completions WHERE occurrence_date IS NOT NULL GROUP BY task_id, occurrence_date)"
+            )
+            conn.execute("DROP INDEX IF EXISTS idx_completions_occurrence")
+            conn.execute(SCHEMA_INDEXES)
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
 def init_db(conn: Optional[sqlite3.Connection] = None) -> None:
     owns = False
     if conn is None:
         conn = connect()
         owns = True
+    elif getattr(conn, "migrated", False):
+        return
     try:
         conn.executescript(SCHEMA_TASKS)
         conn.executescript(SCHEMA_COMPLETIONS)
-        conn.commit()
+        _migrate(conn)
     finally:
         if owns:
             conn.close()
\ No newline at end of file
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import datetime as dt
+import json
+import multiprocessing
+import shutil
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .config import MAX_OCCURRENCE_WINDOW_DAYS, db_path, job_max_pending, job_workers, jobs_dir
+from .db import connect, init_db, shard_pool, use_readonly
+from .shards import current_family, family_session
+from .storage import export_daily_summary, list_occurrences, list_tasks
+
+
+# 后台任务：导出与聚合在独立进程中以只读连接执行，避免占用请求线程和 GIL。
+# 每个任务产出若干结果文件 {名称: 路径}。
+
+
+def _job_daily_summary(params: dict, out_dir: Path) -> Dict[str, str]:
+    # Write into the job's own folder so later runs cannot overwrite this job's result
+    txt, csv = export_daily_summary(target_dir=out_dir)
+    return {"txt": str(txt), "csv": str(csv)}
+
+
+def _job_tasks(params: dict, out_dir: Path) -> Dict[str, str]:
+    tasks = list_tasks(search=params.get("search"), category=params.get("category"))
+    path = out_dir / "tasks.json"
+    path.write_text(json.dumps([asdict(t) for t in tasks], ensure_ascii=False), encoding="utf-8")
+    return {"json": str(path)}
+
+
+def _job_occurrences(params: dict, out_dir: Path) -> Dict[str, str]:
+    start = dt.date.fromisoformat(params["start"])
+    end = dt.date.fromisoformat(params["end"])
+    occurrences = list_occurrences(start, end, category=params.get("category"))
+    path = out_dir / "occurrences.json"
+    path.write_text(json.dumps([asdict(o) for o in occurrences], ensure_ascii=False), encoding="utf-8")
+    return {"json": str(path)}
+
+
+def _check_keys(params: dict, allowed: Tuple[str, ...]) -> None:
+    unknown = sorted(set(params) - set(allowed))
+    if unknown:
+        raise ValueError(f"unknown params: {', '.join(unknown)}")
+
+
+def _check_optional_str(params: dict, name: str) -> Optional[str]:
+    value = params.get(name)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value or None
+
+
+def _params_daily_summary(params: dict) -> dict:
+    _check_keys(params, ())
+    return {}
+
+
+def _params_tasks(params: dict) -> dict:
+    _check_keys(params, ("search", "category"))
+    return {
+        "search": _check_optional_str(params, "search"),
+        "category": _check_optional_str(params, "category"),
+    }
+
+
+def _params_occurrences(params: dict) -> dict:
+    _check_keys(params, ("start", "end", "category"))
+    try:
+        start = dt.date.fromisoformat(params["start"])
+        end = dt.date.fromisoformat(params["end"])
+    except KeyError as e:
+        raise ValueError(f"missing param: {e.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("start and end must be YYYY-MM-DD dates")
+    if end < start or (end - start).days >= MAX_OCCURRENCE_WINDOW_DAYS:
+        raise ValueError("invalid occurrence window")
+    return {"start": start.isoformat(), "end": end.isoformat(), "category": _check_optional_str(params, "category")}
+
+
+# Params are checked and normalized at submit time, so bad jobs never reach a worker
+JOB_PARAMS: Dict[str, Callable[[dict], dict]] = {
+    "daily_summary": _params_daily_summary,
+    "tasks": _params_tasks,
+    "occurrences": _params_occurrences,
+}
+
+JOB_KINDS: Dict[str, Callable[[dict, Path], Dict[str, str]]] = {
+    "daily_summary": _job_daily_summary,
+    "tasks": _job_tasks,
+    "occurrences": _job_occurrences,
+}
+
+
+def _run_job(kind: str, params: dict, family_id: Optional[str], db_file: str, out_dir: str) -> Dict[str, str]:
+    # Entry point inside the worker process
+    use_readonly(Path(db_file))
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        if family_id:
+            stack.enter_context(family_session(family_id))
+        return JOB_KINDS[kind](params, Path(out_dir))
+
+
+def _remove_outputs(out_dirs: List[str]) -> None:
+    for out_dir in out_dirs:
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: dict
+    family_id: Optional[str]
+    created_at: str
+    status: str = "queued"  # queued | running | done | failed | cancelled
+    finished_at: Optional[str] = None
+    files: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    out_dir: str = ""
+    db_file: str = field(default="", repr=False)
+    key: Tuple[str, Optional[str], str] = field(default=("", None, ""), repr=False)
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        # Read through JobManager.describe(), which holds the manager lock
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "files": sorted(self.files),
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """有界进程池上的任务表：提交、查询、取消，并对相同的进行中任务去重。
+
+    排队中的任务保存在本地队列里，只有空闲 worker 时才交给进程池，因此可随时取消；
+    已开始运行的任务无法中断，取消后其结果会被丢弃。任务状态只在 _lock 下修改。
+    """
+
+    def __init__(self, *, max_workers: Optional[int] = None, max_pending: Optional[int] = None, keep_finished: int = 256):
+        self.max_workers = max_workers or job_workers()
+        self.max_pending = max_pending or job_max_pending()
+        self.keep_finished = keep_finished
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Optional[str], str], str] = {}
+        self._queue: Deque[Job] = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a threaded server with open SQLite handles is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, kind: str, params: Optional[dict] = None) -> Job:
+        """在当前家庭上下文中提交任务；相同参数的进行中任务直接返回。"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"unknown job kind: {kind!r}")
+        params = JOB_PARAMS[kind](params or {})
+        family = current_family()
+        key = (kind, family, json.dumps(params, sort_keys=True, ensure_ascii=False))
+        # Make sure the database exists and is migrated before workers open it read-only
+        conn = connect()
+        init_db(conn)
+        conn.close()
+        db_file = shard_pool().path_for(family) if family else db_path()
+        with self._lock:
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return self._jobs[existing]
+            if len(self._inflight) >= self.max_pending:
+                raise JobQueueFull(f"too many pending jobs (max {self.max_pending})")
+            job = Job(
+                id=uuid.uuid4().hex,
+                kind=kind,
+                params=params,
+                family_id=family,
+                created_at=dt.datetime.now().isoformat(timespec="seconds"),
+                db_file=str(db_file),
+                key=key,
+            )
+            job.out_dir = str(jobs_dir() / job.id)
+            self._jobs[job.id] = job
+            self._inflight[key] = job.id
+            self._queue.append(job)
+            started = self._dispatch_locked()
+            pruned = self._prune_locked()
+        self._watch(started)
+        _remove_outputs(pruned)
+        return job
+
+    def _dispatch_locked(self) -> List[Job]:
+        # Hand queued jobs to the executor only while a worker is free, so every
+        # job still waiting stays in self._queue where cancel() can drop it
+        started: List[Job] = []
+        while self._queue and self._running < self.max_workers:
+            job = self._queue.popleft()
+            job.future = self._pool().submit(_run_job, job.kind, job.params, job.family_id, job.db_file, job.out_dir)
+            job.status = "running"
+            self._running += 1
+            started.append(job)
+        return started
+
+    def _watch(self, started: List[Job]) -> None:
+        # Outside the lock: add_done_callback runs the callback inline if the future is already done
+        for job in started:
+            job.future.add_done_callback(lambda fut, job=job: self._finish(job, fut))
+
+    def _finish(self, job: Job, fut: Future) -> None:
+        with self._lock:
+            self._running -= 1
+            if self._inflight.get(job.key) == job.id:
+                del self._inflight[job.key]
+            job.finished_at = dt.datetime.now().isoformat(timespec="seconds")
+            exc = None if fut.cancelled() else fut.exception()
+            if isinstance(exc, BrokenProcessPool) and self._executor is not None:
+                # A worker died; start a fresh pool for the next submission
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if job.status == "cancelled" or fut.cancelled():
+                job.status = "cancelled"
+            elif exc is not None:
+                job.status = "failed"
+                job.error = f"{type(exc).__name__}: {exc}"
+            else:
+                job.files = fut.result()
+                job.status = "done"
+            discard = job.status != "done"
+            started = self._dispatch_locked()
+        self._watch(started)
+        if discard:
+            # Cancelled/failed jobs keep no output; the worker is done with the folder by now
+            _remove_outputs([job.out_dir])
+
+    def _prune_locked(self) -> List[str]:
+        # Returns the output folders of dropped jobs; callers delete them outside the lock
+        finished = [jid for jid, j in self._jobs.items() if j.status in ("done", "failed", "cancelled")]
+        dropped: List[str] = []
+        for jid in finished[: max(0, len(finished) - self.keep_finished)]:
+            dropped.append(self._jobs.pop(jid).out_dir)
+        return dropped
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """返回当前家庭可见的任务。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.family_id != current_family():
+            return None
+        return job
+
+    def describe(self, job: Job) -> dict:
+        """在锁内生成任务状态快照，避免与 _finish 的更新交错。"""
+        with self._lock:
+            return job.to_dict()
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status in ("done", "failed", "cancelled"):
+                return job
+            if job.status == "queued":
+                # Never reached a worker: drop it from the local queue
+                self._queue.remove(job)
+                job.finished_at = dt.datetime.now().isoformat(timespec="seconds")
+            job.status = "cancelled"
+            # Drop from dedup so an identical job can be resubmitted right away
+            if self._inflight.get(job.key) == job.id:
+                del self._inflight[job.key]
+        return job
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        # The job table lives in memory only, so its outputs go with it
+        with self._lock:
+            out_dirs = [j.out_dir for j in self._jobs.values()]
+            self._jobs.clear()
+            self._inflight.clear()
+            self._queue.clear()
+        _remove_outputs(out_dirs)
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import datetime as dt
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+
+# 重复规则以紧凑字符串存放在 tasks.recurrence 中：
+#   daily            每天
+#   weekly           每周（与锚定日期同一星期几）
+#   weekdays:0,2,4   指定星期几（周一=0 ... 周日=6）
+#   every:3          每 N 天（从锚定日期起算）
+# 发生实例(occurrence)从不落库，只在请求的窗口内惰性展开。
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+@dataclass(frozen=True)
+class Rule:
+    kind: str  # 'every' | 'weekdays'
+    interval: int = 1
+    weekdays: Tuple[int, ...] = ()
+
+
+def _parse_weekday(token: str) -> int:
+    token = token.strip().lower()
+    if token.isdigit():
+        day = int(token)
+    elif token[:3] in WEEKDAY_NAMES:
+        day = WEEKDAY_NAMES.index(token[:3])
+    else:
+        raise ValueError(f"invalid weekday: {token!r}")
+    if not 0 <= day <= 6:
+        raise ValueError(f"invalid weekday: {token!r}")
+    return day
+
+
+def parse_rule(text: str) -> Rule:
+    """解析重复规则字符串，非法时抛出 ValueError。"""
+    raw = (text or "").strip().lower()
+    kind, _, arg = raw.partition(":")
+    if kind == "daily" and not arg:
+        return Rule(kind="every", interval=1)
+    if kind == "weekly" and not arg:
+        return Rule(kind="every", interval=7)
+    if kind == "every":
+        if not arg.isdigit() or int(arg) < 1:
+            raise ValueError(f"invalid interval: {arg!r}")
+        return Rule(kind="every", interval=int(arg))
+    if kind == "weekdays":
+        days = tuple(sorted({_parse_weekday(t) for t in arg.split(",") if t.strip()}))
+        if not days:
+            raise ValueError("weekdays rule needs at least one day")
+        return Rule(kind="weekdays", weekdays=days)
+    raise ValueError(f"invalid recurrence rule: {text!r}")
+
+
+def format_rule(rule: Rule) -> str:
+    if rule.kind == "weekdays":
+        return "weekdays:" + ",".join(str(d) for d in rule.weekdays)
+    if rule.interval == 1:
+        return "daily"
+    if rule.interval == 7:
+        return "weekly"
+    return f"every:{rule.interval}"
+
+
+def normalize_rule(text: Optional[str]) -> Optional[str]:
+    """校验并规范化规则字符串；空值表示不重复。"""
+    if text is None or not text.strip():
+        return None
+    return format_rule(parse_rule(text))
+
+
+def iter_occurrences(rule: Rule, anchor: dt.date, start: dt.date, end: dt.date) -> Iterator[dt.date]:
+    """惰性产出 [start, end] 内的发生日期（含两端），不早于 anchor。"""
+    first = max(anchor, start)
+    if first > end:
+        return
+    if rule.kind == "every":
+        offset = (first - anchor).days % rule.interval
+        if offset:
+            first += dt.timedelta(days=rule.interval - offset)
+        step = dt.timedelta(days=rule.interval)
+        day = first
+        while day <= end:
+            yield day
+            day += step
+        return
+    day = first
+    one = dt.timedelta(days=1)
+    while day <= end:
+        if day.weekday() in rule.weekdays:
+            yield day
+        day += one
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+
+# 每个家庭一个 SQLite 分片：<shards_dir>/<family_id>.db
+# 当前请求的家庭通过 contextvar 传递，storage 层无需改签名。
+
+FAMILY_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_current_family: ContextVar[Optional[str]] = ContextVar("todo_tracker_family", default=None)
+_open_leases: ContextVar[Optional[List["PooledConnection"]]] = ContextVar("todo_tracker_leases", default=None)
+
+
+def valid_family_id(family_id: str) -> bool:
+    return bool(FAMILY_ID_RE.match(family_id or ""))
+
+
+def current_family() -> Optional[str]:
+    return _current_family.get()
+
+
+@contextmanager
+def family_session(family_id: str) -> Iterator[None]:
+    """在该上下文内，db.connect() 路由到 family_id 的分片。
+
+    退出时归还上下文内未关闭的连接（异常路径上 storage 可能来不及 close）。
+    """
+    if not valid_family_id(family_id):
+        raise ValueError(f"invalid family id: {family_id!r}")
+    leases: List[PooledConnection] = []
+    family_token = _current_family.set(family_id)
+    leases_token = _open_leases.set(leases)
+    try:
+        yield
+    finally:
+        for lease in list(leases):
+            lease.close()
+        _open_leases.reset(leases_token)
+        _current_family.reset(family_token)
+
+
+@dataclass
+class ShardInfo:
+    family_id: str
+    path: Path
+    size_bytes: int
+    is_open: bool
+
+
+class _Shard:
+    def __init__(self, family_id: str, path: Path, max_conns: int):
+        self.family_id = family_id
+        self.path = path
+        self.idle: List[sqlite3.Connection] = []
+        self.slots = threading.BoundedSemaphore(max_conns)
+        self.open_lock = threading.Lock()
+        self.migrated = False
+        self.users = 0  # holders + waiters; pinned shards are never evicted
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+class PooledConnection:
+    """分片连接的租约：代理 sqlite3.Connection，close() 只是归还给连接池。"""
+
+    # Shards are migrated when first opened, so init_db() can skip them
+    migrated = True
+
+    def __init__(self, pool: "ShardPool", shard: _Shard, conn: sqlite3.Connection):
+        self._pool = pool
+        self._shard = shard
+        self._conn = conn
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        self._pool.release(self)
+
+
+class ShardPool:
+    """按家庭分片的 LRU 连接池。
+
+    每个分片最多 conns_per_shard 条 WAL 连接，读可并发，写由 SQLite 串行；
+    连接都被占用时最多等待 lease_timeout 秒，随后抛出 OperationalError（API 返回 503）。
+    打开的分片数超过 max_open 或空闲超过 idle_seconds 时关闭最久未用的空闲分片，
+    除 acquire() 外还应定期调用 evict_idle()。分片文件在首次访问时由 opener 创建并迁移。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        opener: Callable[[Path, bool], sqlite3.Connection],
+        *,
+        max_open: int = 32,
+        idle_seconds: float = 300.0,
+        conns_per_shard: int = 4,
+        lease_timeout: float = 1.0,
+    ):
+        self.root = root
+        self.max_open = max(1, max_open)
+        self.idle_seconds = idle_seconds
+        self.conns_per_shard = max(1, conns_per_shard)
+        self.lease_timeout = lease_timeout
+        self._opener = opener
+        self._shards: "OrderedDict[str, _Shard]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path_for(self, family_id: str) -> Path:
+        if not valid_family_id(family_id):
+            raise ValueError(f"invalid family id: {family_id!r}")
+        return self.root / f"{family_id}.db"
+
+    def acquire(self, family_id: str) -> PooledConnection:
+        path = self.path_for(family_id)
+        with self._lock:
+            shard = self._shards.get(family_id)
+            if shard is None:
+                shard = _Shard(family_id, path, self.conns_per_shard)
+                self._shards[family_id] = shard
+            self._shards.move_to_end(family_id)
+            shard.users += 1
+            self._evict_locked()
+        if not shard.slots.acquire(timeout=self.lease_timeout):
+            with self._lock:
+                shard.users -= 1
+            raise sqlite3.OperationalError(f"shard {family_id} is busy")
+        try:
+            with self._lock:
+                conn = shard.idle.pop() if shard.idle else None
+            if conn is None:
+                # Only the first connection of a shard runs migrations
+                with shard.open_lock:
+                    self.root.mkdir(parents=True, exist_ok=True)
+                    conn = self._opener(path, not shard.migrated)
+                    shard.migrated = True
+        except BaseException:
+            shard.slots.release()
+            with self._lock:
+                shard.users -= 1
+            raise
+        lease = PooledConnection(self, shard, conn)
+        leases = _open_leases.get()
+        if leases is not None:
+            leases.append(lease)
+        return lease
+
+    def release(self, lease: PooledConnection) -> None:
+        if lease.closed:
+            return
+        lease.closed = True
+        shard = lease._shard
+        conn = lease._conn
+        if conn.in_transaction:
+            conn.rollback()
+        shard.last_used = time.monotonic()
+        with self._lock:
+            shard.idle.append(conn)
+            shard.users -= 1
+        shard.slots.release()
+        leases = _open_leases.get()
+        if leases is not None and lease in leases:
+            leases.remove(lease)
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self) -> int:
+        now = time.monotonic()
+        evicted = 0
+        # OrderedDict iterates least recently used first
+        for family_id, shard in list(self._shards.items()):
+            if shard.users:
+                continue
+            over_cap = len(self._shards) > self.max_open
+            if over_cap or now - shard.last_used > self.idle_seconds:
+                shard.close()
+                del self._shards[family_id]
+                evicted += 1
+        return evicted
+
+    def open_count(self) -> int:
+        with self._lock:
+            return len(self._shards)
+
+    def close_all(self) -> None:
+        with self._lock:
+            for family_id, shard in list(self._shards.items()):
+                if shard.users:
+                    continue
+                shard.close()
+                del self._shards[family_id]
+
+    def list_shards(self) -> List[ShardInfo]:
+        if not self.root.exists():
+            return []
+        with self._lock:
+            open_ids = set(self._shards)
+        infos: List[ShardInfo] = []
+        for path in sorted(self.root.glob("*.db")):
+            if not valid_family_id(path.stem):
+                continue
+            infos.append(ShardInfo(family_id=path.stem, path=path, size_bytes=path.stat().st_size, is_open=path.stem in open_ids))
+        return infos
+
+    def compact(self, family_id: str) -> int:
+        """VACUUM 一个分片，返回回收的字节数。"""
+        path = self.path_for(family_id)
+        if not path.exists():
+            raise FileNotFoundError(path)
+        before = path.stat().st_size
+        conn = self.acquire(family_id)
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+        return before - path.stat().st_size
@@ -8,6 +8,8 @@ from typing import Iterable, List, Optional, Tuple
 
 from .config import PRIORITY_SET, summaries_dir
 from .db import connect, init_db
+from .recurrence import iter_occurrences, normalize_rule, parse_rule
+from .shards import current_family
 
 
 @dataclass
@@ -21,6 +23,7 @@ class Task:
     due_date: Optional[str]
     status: str
     is_temp: int
+    recurrence: Optional[str] = None
 
 
 @dataclass
@@ -29,6 +32,18 @@ class Completion:
     task_id: int
     completed_at: str
     evidence: Optional[str]
+    occurrence_date: Optional[str] = None
+
+
+@dataclass
+class Occurrence:
+    task_id: int
+    title: str
+    category: str
+    priority: str
+    date: str
+    done: bool
+    completion_id: Optional[int]
 
 
 def _row_to_task(row) -> Task:
@@ -42,9 +57,21 @@ def _row_to_task(row) -> Task:
         due_date=row["due_date"],
         status=row["status"],
         is_temp=row["is_temp"],
+        recurrence=row["recurrence"],
     )
 
 
+def _anchor_date(row) -> dt.date:
+    # Recurrence is anchored on the due date when present, else on creation
+    for value in (row["due_date"], row["created_at"]):
+        if value:
+            try:
+                return dt.date.fromisoformat(value[:10])
+            except ValueError:
+                continue
+    return dt.date.today()
+
+
 def list_tasks(search: Optional[str] = None, category: Optional[str] = None) -> List[Task]:
     conn = connect()
     init_db(conn)
@@ -66,14 +93,38 @@ def list_tasks(search: Optional[str] = None, category: Optional[str] = None) ->
     return [_row_to_task(r) for r in rows]
 
 
-def add_task(title: str, description: str = "", category: str = "", priority: str = "中", due_date: Optional[str] = None, is_temp: int = 0) -> int:
+def task_facets() -> dict:
+    """返回分类/优先级/状态计数及逾期、今日到期数。
+
+    只读取由触发器维护的 facet_counts，不扫描 tasks。
+    """
+    conn = connect()
+    init_db(conn)
+    facets: dict = {"category": {}, "priority": {}, "status": {}}
+    for r in conn.execute("SELECT facet, value, count FROM facet_counts WHERE facet != 'due'"):
+        facets.setdefault(r["facet"], {})[r["value"]] = r["count"]
+    today = dt.date.today().isoformat()
+    row = conn.execute(
+        "SELECT COALESCE(SUM(CASE WHEN value < ? THEN count END), 0) AS overdue, "
+        "COALESCE(SUM(CASE WHEN value = ? THEN count END), 0) AS due_today "
+        "FROM facet_counts WHERE facet = 'due' AND value <= ?",
+        (today, today, today),
+    ).fetchone()
+    conn.close()
+    facets["overdue"] = int(row["overdue"])
+    facets["due_today"] = int(row["due_today"])
+    return facets
+
+
+def add_task(title: str, description: str = "", category: str = "", priority: str = "中", due_date: Optional[str] = None, is_temp: int = 0, recurrence: Optional[str] = None) -> int:
     assert priority in PRIORITY_SET
+    recurrence = normalize_rule(recurrence)
     now = dt.datetime.now().isoformat(timespec="seconds")
     conn = connect()
     init_db(conn)
     cur = conn.execute(
-        "INSERT INTO tasks(title, description, category, priority, created_at, due_date, status, is_temp) VALUES(?,?,?,?,?,?, '未完成', ?)",
-        (title, description, category, priority, now, due_date, is_temp),
+        "INSERT INTO tasks(title, description, category, priority, created_at, due_date, status, is_temp, recurrence) VALUES(?,?,?,?,?,?, '未完成', ?, ?)",
+        (title, description, category, priority, now, due_date, is_temp, recurrence),
     )
     conn.commit()
     task_id = cur.lastrowid
@@ -81,9 +132,21 @@ def add_task(title: str, description: str = "", category: str = "", priority: st
     return int(task_id)
 
 
-def update_task(task_id: int, *, title: Optional[str] = None, description: Optional[str] = None, category: Optional[str] = None, priority: Optional[str] = None, due_date: Optional[str] = None) -> None:
+def update_task(task_id: int, *, title: Optional[str] = None, description: Optional[str] = None, category: Optional[str] = None, priority: Optional[str] = None, due_date: Optional[str] = None, recurrence: Optional[str] = None) -> None:
+    """更新任务字段；recurrence 传空字符串表示取消重复。
+
+    截止日期是重复任务的锚点，修改它会让已有的按发生日期完成记录错位，
+    因此仍为重复任务时拒绝修改截止日期（ValueError），需先取消重复。
+    """
+    rule = normalize_rule(recurrence) if recurrence is not None else None
     conn = connect()
     init_db(conn)
+    if due_date is not None:
+        row = conn.execute("SELECT due_date, recurrence FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        stays_recurring = rule if recurrence is not None else (row is not None and row["recurrence"])
+        if row is not None and row["recurrence"] and stays_recurring and due_date != row["due_date"]:
+            conn.close()
+            raise ValueError(f"task {task_id} is recurring; its due date is the recurrence anchor and cannot be changed")
     fields: List[str] = []
     values: List[Optional[str]] = []
     if title is not None:
@@ -102,6 +165,9 @@ def update_task(task_id: int, *, title: Optional[str] = None, description: Optio
     if due_date is not None:
         fields.append("due_date = ?")
         values.append(due_date)
+    if recurrence is not None:
+        fields.append("recurrence = ?")
+        values.append(rule)
     if not fields:
         conn.close()
         return
@@ -119,15 +185,40 @@ def delete_task(task_id: int) -> None:
     conn.close()
 
 
-def record_completion(task_id: int, evidence: Optional[str] = None) -> int:
+def record_completion(task_id: int, evidence: Optional[str] = None, occurrence_date: Optional[str] = None) -> int:
+    """记录一次完成。
+
+    重复任务的完成绑定到某个发生日期（默认今天），任务本身保持未完成；
+    同一发生日期重复完成时返回已有记录 ID。非法发生日期抛出 ValueError。
+    """
     now = dt.datetime.now().isoformat(timespec="seconds")
     conn = connect()
     init_db(conn)
-    cur = conn.execute(
-        "INSERT INTO completions(task_id, completed_at, evidence) VALUES(?,?,?)",
-        (task_id, now, evidence),
-    )
-    conn.execute("UPDATE tasks SET status='已完成' WHERE id=?", (task_id,))
+    task = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    if task is not None and task["recurrence"]:
+        day = dt.date.fromisoformat(occurrence_date[:10]) if occurrence_date else dt.date.today()
+        if next(iter_occurrences(parse_rule(task["recurrence"]), _anchor_date(task), day, day), None) is None:
+            conn.close()
+            raise ValueError(f"task {task_id} does not occur on {day.isoformat()}")
+        # The unique (task_id, occurrence_date) index makes concurrent completes collapse to one row
+        conn.execute(
+            "INSERT INTO completions(task_id, completed_at, evidence, occurrence_date) VALUES(?,?,?,?) "
+            "ON CONFLICT(task_id, occurrence_date) DO NOTHING",
+            (task_id, now, evidence, day.isoformat()),
+        )
+        conn.commit()
+        row = conn.execute(
+            "SELECT id FROM completions WHERE task_id = ? AND occurrence_date = ?",
+            (task_id, day.isoformat()),
+        ).fetchone()
+        conn.close()
+        return int(row["id"])
+    else:
+        cur = conn.execute(
+            "INSERT INTO completions(task_id, completed_at, evidence) VALUES(?,?,?)",
+            (task_id, now, evidence),
+        )
+        conn.execute("UPDATE tasks SET status='已完成' WHERE id=?", (task_id,))
     conn.commit()
     cid = cur.lastrowid
     conn.close()
@@ -140,17 +231,24 @@ def quick_complete(title: str, evidence: Optional[str] = None) -> Tuple[int, int
     return task_id, cid
 
 
-def undo_last_completion(task_id: int) -> Optional[int]:
+def undo_last_completion(task_id: int, occurrence_date: Optional[str] = None) -> Optional[int]:
     """撤销最近一次完成记录，并将任务状态改回未完成。
 
+    指定 occurrence_date 时只撤销该发生日期的完成记录（用于重复任务）。
     返回被删除的完成记录 ID（若无记录则返回 None）。
     """
     conn = connect()
     init_db(conn)
-    row = conn.execute(
-        "SELECT id FROM completions WHERE task_id = ? ORDER BY completed_at DESC LIMIT 1",
-        (task_id,),
-    ).fetchone()
+    if occurrence_date:
+        row = conn.execute(
+            "SELECT id FROM completions WHERE task_id = ? AND occurrence_date = ? ORDER BY completed_at DESC LIMIT 1",
+            (task_id, occurrence_date[:10]),
+        ).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT id FROM completions WHERE task_id = ? ORDER BY completed_at DESC LIMIT 1",
+            (task_id,),
+        ).fetchone()
     deleted_id: Optional[int] = None
     if row is not None:
         deleted_id = int(row["id"])  # row is Row, index or key both work
@@ -163,41 +261,90 @@ def undo_last_completion(task_id: int) -> Optional[int]:
 
 
 def last_7_day_streak() -> List[bool]:
-    # True/False by day for the last 7 days (today inclusive)
+    # True/False by day for the last 7 days (today inclusive).
+    # Recurring completions count towards their occurrence date, not the day they were ticked.
     conn = connect()
     init_db(conn)
     today = dt.date.today()
-    results: List[bool] = []
-    for i in range(7):
-        day = today - dt.timedelta(days=i)
-        start = dt.datetime.combine(day, dt.time.min).isoformat(timespec="seconds")
-        end = dt.datetime.combine(day, dt.time.max).isoformat(timespec="seconds")
-        row = conn.execute(
-            "SELECT COUNT(*) AS cnt FROM completions WHERE completed_at BETWEEN ? AND ?",
-            (start, end),
-        ).fetchone()
-        results.append(bool(row["cnt"]))
+    first = today - dt.timedelta(days=6)
+    start = dt.datetime.combine(first, dt.time.min).isoformat(timespec="seconds")
+    end = dt.datetime.combine(today, dt.time.max).isoformat(timespec="seconds")
+    rows = conn.execute(
+        "SELECT DISTINCT COALESCE(occurrence_date, substr(completed_at, 1, 10)) AS day FROM completions "
+        "WHERE occurrence_date BETWEEN ? AND ? OR (occurrence_date IS NULL AND completed_at BETWEEN ? AND ?)",
+        (first.isoformat(), today.isoformat(), start, end),
+    ).fetchall()
+    conn.close()
+    done_days = {r["day"] for r in rows}
+    return [(first + dt.timedelta(days=i)).isoformat() in done_days for i in range(7)]  # from oldest -> newest
+
+
+def list_occurrences(start: dt.date, end: dt.date, category: Optional[str] = None) -> List[Occurrence]:
+    """展开 [start, end] 窗口内重复任务的发生实例（按日期、任务排序）。
+
+    实例不落库，只读取窗口内的完成记录来标记 done。
+    """
+    if end < start:
+        raise ValueError("end must not be before start")
+    conn = connect()
+    init_db(conn)
+    q = "SELECT * FROM tasks WHERE recurrence IS NOT NULL"
+    params: List[str] = []
+    if category:
+        q += " AND category = ?"
+        params.append(category)
+    task_rows = conn.execute(q, params).fetchall()
+    done = {
+        (r["task_id"], r["occurrence_date"]): int(r["id"])
+        for r in conn.execute(
+            "SELECT id, task_id, occurrence_date FROM completions WHERE occurrence_date BETWEEN ? AND ?",
+            (start.isoformat(), end.isoformat()),
+        )
+    }
     conn.close()
-    return list(reversed(results))  # from oldest -> newest
+    results: List[Occurrence] = []
+    for t in task_rows:
+        rule = parse_rule(t["recurrence"])
+        for day in iter_occurrences(rule, _anchor_date(t), start, end):
+            cid = done.get((t["id"], day.isoformat()))
+            results.append(
+                Occurrence(
+                    task_id=t["id"],
+                    title=t["title"],
+                    category=t["category"] or "",
+                    priority=t["priority"] or "中",
+                    date=day.isoformat(),
+                    done=cid is not None,
+                    completion_id=cid,
+                )
+            )
+    results.sort(key=lambda o: (o.date, o.task_id))
+    return results
 
 
-def export_daily_summary() -> Tuple[Path, Path]:
-    # Export today's summary to text and CSV
-    sdir = summaries_dir()
+def export_daily_summary(target_dir: Optional[Path] = None) -> Tuple[Path, Path]:
+    # Export today's summary to text and CSV; family shards export into their own folder
+    # unless the caller (e.g. a background job) asks for a private target_dir
+    if target_dir is not None:
+        sdir = target_dir
+    else:
+        family = current_family()
+        sdir = summaries_dir() / family if family else summaries_dir()
+    sdir.mkdir(parents=True, exist_ok=True)
     today = dt.date.today().isoformat()
     txt_path = sdir / f"summary_{today}.txt"
     csv_path = sdir / f"summary_{today}.csv"
 
     conn = connect()
     init_db(conn)
-    start = dt.datetime.combine(dt.date.today(), dt.time.min).isoformat(timespec="seconds")
-    end = dt.datetime.combine(dt.date.today(), dt.time.max).isoformat(timespec="seconds")
     tasks_rows = conn.execute("SELECT * FROM tasks").fetchall()
+    # Recurring completions count for the day they fulfil, like last_7_day_streak()
     comp_rows = conn.execute(
-        "SELECT * FROM completions WHERE completed_at BETWEEN ? AND ? ORDER BY completed_at DESC",
-        (start, end),
+        "SELECT * FROM completions WHERE COALESCE(occurrence_date, substr(completed_at, 1, 10)) = ? ORDER BY completed_at DESC",
+        (today,),
     ).fetchall()
     conn.close()
+    occurrences = {o.task_id: o for o in list_occurrences(dt.date.today(), dt.date.today())}
 
     # Text summary
     with txt_path.open("w", encoding="utf-8") as f:
@@ -210,16 +357,24 @@ def export_daily_summary() -> Tuple[Path, Path]:
         f.write("\n全部任务状态:\n")
         for t in tasks_rows:
             f.write(f"- #{t['id']} [{t['status']}] {t['title']} | {t['category']} | {t['priority']}\n")
+        if occurrences:
+            f.write("\n今日重复任务:\n")
+            for o in occurrences.values():
+                f.write(f"- #{o.task_id} [{'已完成' if o.done else '未完成'}] {o.title} ({o.date})\n")
 
     # CSV summary
     with csv_path.open("w", encoding="utf-8", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["task_id", "status", "title", "category", "priority", "created_at", "due_date", "latest_evidence"])
+        writer.writerow(["task_id", "status", "title", "category", "priority", "created_at", "due_date", "latest_evidence", "recurrence"])
         # Get latest evidence per task for today (simple pass)
         latest_evidence = {r["task_id"]: r["evidence"] for r in comp_rows if r["evidence"]}
         for t in tasks_rows:
+            # Recurring tasks report today's occurrence instead of the (always open) task row
+            status = t["status"]
+            if t["id"] in occurrences:
+                status = "已完成" if occurrences[t["id"]].done else "未完成"
             writer.writerow([
-                t["id"], t["status"], t["title"], t["category"], t["priority"], t["created_at"], t["due_date"], latest_evidence.get(t["id"], "")
+                t["id"], status, t["title"], t["category"], t["priority"], t["created_at"], t["due_date"], latest_evidence.get(t["id"], ""), t["recurrence"] or ""
             ])
 
     return txt_path, csv_path
\ No newline at end of file
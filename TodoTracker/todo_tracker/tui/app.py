@@ -65,6 +65,8 @@ class TaskItem(ListItem):
 
     def compose(self) -> ComposeResult:
         meta = f"#{self.task.id} [{self.task.category or '-'} | {self.task.priority}]"
+        if self.task.recurrence:
+            meta += f" ↻ {self.task.recurrence}"
         stamp = _stamp_for_status(self.task.status)
         momentum = _momentum_bar(self.task.created_at, self.task.due_date)
         evidence_badge = ""  # filled when showing completion evidence on export
@@ -225,14 +227,18 @@ class TodoApp(App):
     def _edit_cb(self, task_id: int, data: dict) -> None:
         if not data:
             return
-        update_task(
-            task_id,
-            title=data.get("title"),
-            description=data.get("description"),
-            category=data.get("category"),
-            priority=data.get("priority"),
-            due_date=data.get("due_date"),
-        )
+        try:
+            update_task(
+                task_id,
+                title=data.get("title"),
+                description=data.get("description"),
+                category=data.get("category"),
+                priority=data.get("priority"),
+                due_date=data.get("due_date"),
+            )
+        except ValueError as e:
+            self.notify(str(e), title="无法保存", severity="warning")
+            return
         self.refresh_list()
 
     def action_delete(self) -> None:
@@ -249,7 +255,12 @@ class TodoApp(App):
         self.push_screen(EvidenceForm(), lambda ev: self._complete_cb(tid, ev))
 
     def _complete_cb(self, task_id: int, evidence: str) -> None:
-        record_completion(task_id, evidence=evidence or None)
+        try:
+            record_completion(task_id, evidence=evidence or None)
+        except ValueError as e:
+            # e.g. a recurring task that has no occurrence today
+            self.notify(str(e), title="无法完成", severity="warning")
+            return
         self.refresh_list()
 
     def action_quick(self) -> None: